@@ -1,55 +1,157 @@
 # %%
-import base64
 import datetime
+import functools
 import json
+import mmap
 import os
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 from pathlib import Path
 from dotenv import load_dotenv
 import requests
+from requests.adapters import HTTPAdapter
 import yaml
-from PIL import Image
+
+try:
+    # SIMD 実装の pybase64 があれば優先して使う (API は標準の base64 と互換)
+    import pybase64 as base64
+    _b64encode_as_string = base64.b64encode_as_string
+except ImportError:
+    import base64
+
+    def _b64encode_as_string(data):
+        return base64.b64encode(data).decode('ascii')
+
+try:
+    # libyaml の C 実装があれば使う
+    from yaml import CSafeDumper as YamlDumper, CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeDumper as YamlDumper, SafeLoader as YamlLoader
+
+try:
+    # Rust 実装の orjson があれば JSON の読み書きに使う
+    import orjson
+
+    json_loads = orjson.loads
+
+    def json_dumps_bytes(obj, indent=False):
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else None)
+except ImportError:
+    json_loads = json.loads
+
+    def json_dumps_bytes(obj, indent=False):
+        if indent:
+            return json.dumps(obj, ensure_ascii=False, indent=2).encode('utf-8')
+        # orjson と同じく区切りの空白を入れずに出力する
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def parse_response_json(response):
+    # response.json() と違い、本文を str にデコードせずバイト列のままパースする
+    return json_loads(response.content)
+
+
+# リクエスト間で TCP/TLS 接続を使い回すための共有セッション
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=4))
 
 # %%
 
 
 def encode_image_to_base64(image_path):
+    # mmap でページキャッシュを直接エンコーダに渡し、中間の bytes コピーを避ける
     with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
+        if os.fstat(image_file.fileno()).st_size == 0:
+            return ""  # 空ファイルは mmap できない
+        with mmap.mmap(image_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return _b64encode_as_string(mapped)
 
 
 def get_image_from_base64(base64_image):
-    return Image.open(BytesIO(base64.b64decode(base64_image)))
+    # Pillow は CLI の通常経路では不要なので使う時に読み込む
+    from PIL import Image
+    return Image.open(BytesIO(base64.b64decode(base64_image, validate=True)))
 
 
 def show_image_from_base64(base64_image):
     get_image_from_base64(base64_image).show()
 
 
+# data URL のヘッダ ("data:image/png;base64," など) の探索範囲
+_DATA_URL_HEADER_MAX_LENGTH = 256
+
+
 def base64_url_to_base64_image(base64_url):
     # data:image/{format};base64,{data} 形式から base64 データを抽出
-    if ";base64," in base64_url:
-        return base64_url.split(";base64,", 1)[1]
+    # base64 データ部に ";" は現れないので、先頭のヘッダ部分だけを 1 回走査する
+    marker_index = base64_url.find(";base64,", 0, _DATA_URL_HEADER_MAX_LENGTH)
+    if marker_index != -1:
+        return base64_url[marker_index + len(";base64,"):]
     return base64_url  # すでに base64 データの場合はそのまま返す
 
 
+def detect_image_extension(image_data):
+    # 先頭のマジックバイトから画像フォーマットを判別 (不明な場合は None)
+    if image_data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if image_data.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    if image_data.startswith((b"GIF87a", b"GIF89a")):
+        return "gif"
+    if image_data[:4] == b"RIFF" and image_data[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
 def save_base64_url_to_file(base64_url, output_path):
     base64_image = base64_url_to_base64_image(base64_url)
-    image_data = base64.b64decode(base64_image)
+    image_data = base64.b64decode(base64_image, validate=True)
     
     # 画像フォーマットを自動判別
-    image = Image.open(BytesIO(image_data))
+    format_extension = detect_image_extension(image_data)
+    if format_extension is None:
+        # 既知のマジックバイトに一致しない場合のみ Pillow で判別する
+        from PIL import Image
+        image = Image.open(BytesIO(image_data))
+        format_extension = image.format.lower() if image.format else 'png'
     
     # 出力パスの拡張子を画像フォーマットに合わせる
     output_path = Path(output_path)
-    format_extension = image.format.lower() if image.format else 'png'
     output_path = output_path.with_suffix(f'.{format_extension}')
     
-    # 画像を保存
-    image.save(output_path)
+    # デコード済みのバイト列をそのまま保存 (再エンコードしない)
+    output_path.write_bytes(image_data)
     return output_path
 
 
+@functools.lru_cache(maxsize=10)
+def _encode_image_to_data_url_cached(image_path, mtime_ns, size):
+    # mtime_ns と size はキャッシュキーとしてのみ使用 (ファイルが更新されたら再エンコード)
+    # base64 文字列を data URL にした時点で手放し、巨大な中間文字列を同時に保持しない
+    return "data:image/jpeg;base64," + encode_image_to_base64(image_path)
+
+
+def encode_image_to_data_url(image_path):
+    stat = os.stat(image_path)
+    return _encode_image_to_data_url_cached(os.fspath(image_path), stat.st_mtime_ns, stat.st_size)
+
+
+def encode_images_to_data_urls(image_paths):
+    # 同じ画像が複数指定されていても 1 回だけエンコードする
+    unique_paths = list(dict.fromkeys(os.fspath(path) for path in image_paths))
+
+    # 複数画像のエンコードはスレッドで並列化 (エンコーダの C ループは GIL を解放する)
+    if len(unique_paths) <= 1:
+        data_urls = [encode_image_to_data_url(path) for path in unique_paths]
+    else:
+        max_workers = min(len(unique_paths), os.cpu_count() or 1)
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            data_urls = list(pool.map(encode_image_to_data_url, unique_paths))
+
+    data_url_by_path = dict(zip(unique_paths, data_urls))
+    return [data_url_by_path[os.fspath(path)] for path in image_paths]
+
+
 def image_generation_request(messages, model, openrouter_api_key=None):
     url = "https://openrouter.ai/api/v1/chat/completions"
     headers = {
@@ -63,39 +165,54 @@ def image_generation_request(messages, model, openrouter_api_key=None):
         "modalities": ["image", "text"]
     }
 
-    response = requests.post(url, headers=headers,
-                             json=payload, timeout=(10, 300))
+    # 巨大な base64 文字列を含むため、事前にバイト列へシリアライズして送る
+    body = json_dumps_bytes(payload)
+    response = _SESSION.post(url, headers=headers,
+                             data=body, timeout=(10, 300))
     return response
 
-def save_response_images(output_base_folder, response, prompt_info_data):
-    response_data = response.json()
+def prepare_output_folder(output_base_folder, now=None):
+    # 日付ごとの出力フォルダを作成して返す (書き込めない場合はここで例外にする)
+    now = now or datetime.datetime.now()
+    output_folder_path = Path(output_base_folder) / now.strftime("%Y-%m-%d")
+    output_folder_path.mkdir(parents=True, exist_ok=True)
+    if not os.access(output_folder_path, os.W_OK):
+        raise PermissionError(f"出力フォルダに書き込めません: {output_folder_path}")
+    return output_folder_path
+
+
+def save_response_images(output_base_folder, response, prompt_info_data, response_data=None):
+    # 呼び出し側でパース済みならそれを使い、巨大な JSON の再パースを避ける
+    if response_data is None:
+        response_data = parse_response_json(response)
     images = response_data.get("choices", [])[0].get(
         "message", {}).get("images", [])
 
     now = datetime.datetime.now()
-    yyyymmdd_hy = now.strftime("%Y-%m-%d")
     yyyymmddhhmmss = now.strftime("%Y%m%d%H%M%S")
 
     id = response_data.get("id", "unknown_id")
+    prefix = f"{yyyymmddhhmmss}_{id}"
 
-    today_folder = output_base_folder / yyyymmdd_hy
-    today_folder.mkdir(parents=True, exist_ok=True)
-    output_folder_path = today_folder
-    output_json_path = output_folder_path / f"{yyyymmddhhmmss}_{id}_response.json"
+    output_folder_path = prepare_output_folder(output_base_folder, now)
+    output_json_path = output_folder_path / f"{prefix}_response.json"
 
-    output_folder_path.mkdir(parents=True, exist_ok=True)
-    output_json_path.write_text(json.dumps(
-        response_data, indent=2), encoding="utf-8")
+    output_json_path.write_bytes(json_dumps_bytes(response_data, indent=True))
 
-    for idx, image_info in enumerate(images):
-        base64_response = image_info["image_url"]["url"]
-        output_image_path = output_folder_path / f"{yyyymmddhhmmss}_{id}_{idx}"
-        saved_path = save_base64_url_to_file(base64_response, output_image_path)
-        print(f"Saved image to {saved_path}")
+    # 各画像のデコードと書き込みは独立しているのでスレッドで並列化
+    base64_responses = [image_info["image_url"]["url"] for image_info in images]
+    output_image_paths = [
+        output_folder_path / f"{prefix}_{idx}"
+        for idx in range(len(images))
+    ]
+    if images:
+        with ThreadPoolExecutor(max_workers=min(len(images), 4)) as pool:
+            for saved_path in pool.map(save_base64_url_to_file, base64_responses, output_image_paths):
+                print(f"Saved image to {saved_path}")
 
     # prompt_info.yamlを保存
-    prompt_info_output_path = output_folder_path / f"{yyyymmddhhmmss}_{id}_prompt_info.yaml"
-    prompt_info_output_path.write_text(yaml.dump(prompt_info_data, allow_unicode=True), encoding="utf-8")
+    prompt_info_output_path = output_folder_path / f"{prefix}_prompt_info.yaml"
+    prompt_info_output_path.write_text(yaml.dump(prompt_info_data, Dumper=YamlDumper, allow_unicode=True), encoding="utf-8")
 
     return output_folder_path
 
@@ -106,10 +223,10 @@ def gemini_pro_3_image_preview_request(prompt_text, image_paths, openrouter_api_
         {
             "type": "image_url",
             "image_url": {
-                "url": f"data:image/jpeg;base64,{encode_image_to_base64(path)}"
+                "url": data_url
             }
         }
-        for path in image_paths
+        for data_url in encode_images_to_data_urls(image_paths)
     ]
 
     messages = [
@@ -131,10 +248,10 @@ def flux_2_pro_image_preview_request(prompt_text, image_paths, openrouter_api_ke
         {
             "type": "image_url",
             "image_url": {
-                "url": f"data:image/jpeg;base64,{encode_image_to_base64(path)}"
+                "url": data_url
             }
         }
-        for path in image_paths
+        for data_url in encode_images_to_data_urls(image_paths)
     ]
 
     messages = [
@@ -158,7 +275,7 @@ def main():
 
     prompt_info_path = Path("prompt_info.yaml")
     with prompt_info_path.open("r", encoding="utf-8") as f:
-        prompt_info = yaml.safe_load(f)
+        prompt_info = yaml.load(f, Loader=YamlLoader)
         prompt_text = prompt_info.get("text", "")
         image_paths = prompt_info.get("image_paths", [])
 
@@ -0,0 +1,38 @@
+import pytest
+
+import ui
+import utility
+
+
+class _FakeResponse:
+    status_code = 200
+    text = ""
+    content = (b'{"id": "gen-1", "choices": [{"message": {"content": "ok", "images": []}, '
+               b'"native_finish_reason": "STOP"}]}')
+
+
+@pytest.fixture
+def settings_dir(tmp_path, monkeypatch):
+    """設定フォルダを一時フォルダに切り替え、終了時に未保存の設定を書き出す"""
+    monkeypatch.setenv("SETTING_FOLDER_PATH", str(tmp_path))
+    monkeypatch.setattr(utility, "_HISTORY_VALIDATION_STARTED", True)
+    monkeypatch.setattr(utility, "_SETTINGS_CACHE", {
+        "key": None, "data": None, "favorites_set": frozenset(),
+        "version": 0, "dirty": False})
+    yield tmp_path
+    utility.flush_settings()
+
+
+def test_run_request_reports_invalid_output_folder(settings_dir, monkeypatch):
+    image_path = settings_dir / "input.png"
+    image_path.touch()
+    not_a_folder = settings_dir / "file.txt"
+    not_a_folder.write_text("")
+    monkeypatch.setattr(ui, "gemini_pro_3_image_preview_request",
+                        lambda prompt, image_paths, api_key: _FakeResponse())
+
+    image_paths = [str(image_path)] + [""] * 9
+    result = ui.run_request(str(not_a_folder), "key", "google/gemini-3-pro-image-preview",
+                            "prompt", *image_paths, *(["全て"] * 10))
+
+    assert result[0].startswith("エラーが発生しました")
@@ -0,0 +1,241 @@
+import os
+import threading
+
+import pytest
+
+import utility
+
+
+@pytest.fixture
+def settings_dir(tmp_path, monkeypatch):
+    """設定フォルダを一時フォルダに切り替え、utilityのキャッシュ状態を初期化する"""
+    monkeypatch.setenv("SETTING_FOLDER_PATH", str(tmp_path))
+    monkeypatch.setattr(utility, "SETTINGS_FLUSH_DELAY", 0.05)
+    monkeypatch.setattr(utility, "_HISTORY_VALIDATION_STARTED", True)
+    monkeypatch.setattr(utility, "_SETTINGS_CACHE", {
+        "key": None, "data": None, "favorites_set": frozenset(),
+        "version": 0, "dirty": False})
+    utility.clear_path_status_cache()
+    yield tmp_path
+    utility.flush_settings()
+    utility.clear_path_status_cache()
+
+
+def test_pending_history_survives_concurrent_reads(settings_dir):
+    image_paths = []
+    for i in range(200):
+        image_path = settings_dir / f"image_{i}.png"
+        image_path.touch()
+        image_paths.append(str(image_path))
+
+    stop = threading.Event()
+
+    def poll():
+        while not stop.is_set():
+            utility.get_settings_version()
+            utility.get_favorites_set()
+
+    readers = [threading.Thread(target=poll) for _ in range(2)]
+    for reader in readers:
+        reader.start()
+    try:
+        for image_path in image_paths:
+            utility.add_many_to_history([image_path])
+    finally:
+        stop.set()
+        for reader in readers:
+            reader.join()
+
+    utility.flush_settings()
+    saved = utility.json_loads((settings_dir / "settings.json").read_bytes())
+    assert saved["image_path_history"] == image_paths[::-1]
+
+
+def test_validate_history_prunes_missing_paths(settings_dir):
+    existing_path = settings_dir / "exists.png"
+    existing_path.touch()
+    missing_path = settings_dir / "missing.png"
+    utility.save_settings({"image_path_history": [str(missing_path), str(existing_path)]})
+
+    utility._validate_history()
+
+    saved = utility.json_loads((settings_dir / "settings.json").read_bytes())
+    assert saved["image_path_history"] == [str(existing_path)]
+
+
+def test_settings_version_is_stable_without_settings_file(settings_dir):
+    first = utility.get_settings_version()
+    assert utility.get_settings_version() == first
+    assert utility.load_settings() is utility.load_settings()
+
+
+def test_corrupt_settings_file_is_parsed_once(settings_dir, monkeypatch):
+    (settings_dir / "settings.json").write_text("{not json")
+    calls = []
+    original_loads = utility.json_loads
+
+    def counting_loads(data):
+        calls.append(data)
+        return original_loads(data)
+
+    monkeypatch.setattr(utility, "json_loads", counting_loads)
+    first = utility.get_settings_version()
+    assert utility.load_settings()["image_path_history"] == []
+    assert utility.get_settings_version() == first
+    assert len(calls) == 1
+
+
+def test_first_thumbnail_write_evicts_old_cache_entries(settings_dir, monkeypatch):
+    from PIL import Image
+
+    monkeypatch.setattr(utility, "_THUMBNAIL_WRITE_COUNT", 0)
+    monkeypatch.setattr(utility, "MAX_THUMBNAIL_CACHE_BYTES", 1)
+    cache_dir = utility.get_thumbnail_cache_dir()
+    cache_dir.mkdir()
+    stale_thumbnail = cache_dir / "old.webp"
+    stale_thumbnail.write_bytes(b"x" * 100)
+    os.utime(stale_thumbnail, ns=(0, 0))
+    stale_tmp = cache_dir / "old.123.456.tmp"
+    stale_tmp.write_bytes(b"x")
+    os.utime(stale_tmp, ns=(0, 0))
+
+    image_path = settings_dir / "image.png"
+    Image.new("RGB", (32, 32)).save(image_path)
+    utility.get_gallery_thumbnail(str(image_path))
+
+    assert not stale_thumbnail.exists()
+    assert not stale_tmp.exists()
+
+
+def test_failed_thumbnail_write_leaves_no_temp_file(settings_dir, monkeypatch):
+    from PIL import Image
+
+    image_path = settings_dir / "image.png"
+    Image.new("RGB", (32, 32)).save(image_path)
+
+    def failing_replace(src, dst):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(utility.os, "replace", failing_replace)
+    assert utility.get_gallery_thumbnail(str(image_path)) is not None
+    assert list(utility.get_thumbnail_cache_dir().glob("*.tmp")) == []
+
+
+@pytest.mark.parametrize("value", [256, "256", [256], [0, 256], [256, 256, 256], [1.5, 2], None])
+def test_invalid_gallery_thumbnail_size_falls_back_to_default(value):
+    settings = {"gallery_thumbnail_size": value}
+    assert utility._get_thumbnail_size(settings) == utility.GALLERY_THUMBNAIL_SIZE
+
+
+def test_gallery_thumbnail_size_from_settings():
+    assert utility._get_thumbnail_size({"gallery_thumbnail_size": [128, 96]}) == (128, 96)
+
+
+@pytest.mark.parametrize("value, expected", [("2", 2), (None, 300), ("many", 300), (-1, 300), (2.0, 2)])
+def test_max_history_count_is_coerced_on_save(settings_dir, value, expected):
+    history = [f"/images/{i}.png" for i in range(400)]
+    utility.save_settings({"image_path_history": history, "max_history_count": value})
+
+    saved = utility.json_loads((settings_dir / "settings.json").read_bytes())
+    assert saved["image_path_history"] == history[:expected]
+
+
+def test_save_settings_keeps_file_permissions(settings_dir):
+    settings_path = settings_dir / "settings.json"
+    settings_path.write_bytes(b"{}")
+    settings_path.chmod(0o644)
+
+    utility.save_settings({"image_path_history": []})
+
+    assert settings_path.stat().st_mode & 0o777 == 0o644
+
+
+def test_new_settings_file_uses_umask_permissions(settings_dir):
+    utility.save_settings({"image_path_history": []})
+
+    mode = (settings_dir / "settings.json").stat().st_mode & 0o777
+    assert mode == utility._NEW_FILE_MODE
+
+
+@pytest.mark.parametrize("image_format", ["BMP", "TIFF"])
+def test_preview_and_thumbnail_open_formats_outside_image_formats(settings_dir, image_format):
+    from PIL import Image
+
+    image_path = settings_dir / f"image.{image_format.lower()}"
+    Image.new("RGB", (600, 400)).save(image_path, image_format)
+
+    assert utility.load_image_preview(str(image_path)).size == (256, 171)
+    assert utility.get_gallery_thumbnail(str(image_path)).size == (256, 171)
+
+
+def test_validate_and_preview_warns_when_preview_is_skipped(settings_dir, monkeypatch):
+    from PIL import Image
+
+    image_path = settings_dir / "large.png"
+    Image.new("RGB", (32, 32)).save(image_path)
+    monkeypatch.setattr(utility, "MAX_PREVIEW_FILE_SIZE", 1)
+
+    warning, preview = utility.validate_and_preview(f'"{image_path}"')
+
+    assert preview is None
+    assert "プレビューを省略" in warning
+
+
+def test_validate_and_preview_warns_for_missing_path(settings_dir):
+    warning, preview = utility.validate_and_preview(str(settings_dir / "missing.png"))
+
+    assert preview is None
+    assert "パスが存在しません" in warning
+
+
+def test_validate_history_does_not_hold_lock_during_scan(settings_dir, monkeypatch):
+    existing_path = settings_dir / "exists.png"
+    existing_path.touch()
+    utility.save_settings({"image_path_history": [str(existing_path), "/missing/a.png"]})
+
+    scanning = threading.Event()
+    release = threading.Event()
+    original_filter = utility._filter_existing_paths
+
+    def slow_filter(paths):
+        scanning.set()
+        release.wait(5)
+        return original_filter(paths)
+
+    monkeypatch.setattr(utility, "_filter_existing_paths", slow_filter)
+    validator = threading.Thread(target=utility._validate_history)
+    validator.start()
+    try:
+        assert scanning.wait(5)
+        # 存在確認の最中でも設定を読めて、履歴を追加できる
+        added_path = settings_dir / "added.png"
+        added_path.touch()
+        adder = threading.Thread(target=utility.add_many_to_history, args=([str(added_path)],))
+        adder.start()
+        adder.join(1)
+        assert not adder.is_alive()
+    finally:
+        release.set()
+        validator.join()
+
+    utility.flush_settings()
+    saved = utility.json_loads((settings_dir / "settings.json").read_bytes())
+    assert saved["image_path_history"] == [str(added_path), str(existing_path)]
+
+
+def test_thumbnail_cache_hit_survives_utime_failure(settings_dir, monkeypatch):
+    from PIL import Image
+
+    image_path = settings_dir / "image.png"
+    Image.new("RGB", (32, 32)).save(image_path)
+    utility.get_gallery_thumbnail(str(image_path))
+
+    def failing_utime(*args, **kwargs):
+        raise PermissionError("read-only")
+
+    def unexpected_open_thumbnail(*args, **kwargs):
+        raise AssertionError("cache hit should not decode the source image")
+
+    monkeypatch.setattr(utility.os, "utime", failing_utime)
+    monkeypatch.setattr(utility, "open_thumbnail", unexpected_open_thumbnail)
+    assert utility.get_gallery_thumbnail(str(image_path)).size == (32, 32)
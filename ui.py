@@ -1,23 +1,86 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from dotenv import load_dotenv
-from PIL import Image
 import gradio as gr
 import yaml
-from core import gemini_pro_3_image_preview_request, flux_2_pro_image_preview_request, save_response_images, get_image_from_base64, base64_url_to_base64_image
+from core import gemini_pro_3_image_preview_request, flux_2_pro_image_preview_request, save_response_images, prepare_output_folder, get_image_from_base64, base64_url_to_base64_image, YamlLoader, json_dumps_bytes, json_loads, parse_response_json
 from utility import (
-    add_to_history,
+    add_many_to_history,
     get_history_choices,
-    add_to_favorites,
-    remove_from_favorites,
-    is_favorite,
+    toggle_favorite_path,
     get_history_gallery,
-    load_image_preview,
-    check_image_path,
-    handle_image_upload
+    get_settings_version,
+    validate_and_preview,
+    handle_image_upload,
+    load_preview_cached,
+    load_previews,
+    get_path_status,
+    clear_path_status_cache
 )
 
 
+# 読み込み済みprompt_infoのキャッシュ（キー: (パス, mtime_ns)）
+_YAML_CACHE = {}
+
+# 表示フィルターごとのギャラリー表示内容（キー: filter_mode, 値: (設定のversion, 結果)）
+_GALLERY_CACHE = {}
+
+# 履歴の選択肢のキャッシュ（設定のversionが変わったら取り直す）
+_HISTORY_CHOICES_CACHE = {"version": None, "choices": None}
+
+# 画像フォーム10行分の表示更新（表示数0〜10ごとに事前に作成して使い回す）
+_ROW_UPDATES = [tuple(gr.Row(visible=(i < n)) for i in range(10)) for n in range(11)]
+
+# 生成結果の保存（ディスク書き込み）をUIの応答と切り離して行うスレッドプール
+_SAVE_POOL = ThreadPoolExecutor(max_workers=2)
+
+# 生成された複数の画像を並列にデコードするスレッドプール（デコード中はGILが解放される）
+_DECODE_POOL = ThreadPoolExecutor(max_workers=4)
+
+
+def _report_save_result(future):
+    """バックグラウンド保存で発生したエラーを出力"""
+    error = future.exception()
+    if error is not None:
+        print(f"Failed to save response images: {error}")
+
+
+def _decode_result_image(image_info):
+    """レスポンスの画像情報(data URL)をPIL Imageにデコード"""
+    base64_url = image_info["image_url"]["url"]
+    pil_image = get_image_from_base64(base64_url_to_base64_image(base64_url))
+    pil_image.load()  # 画素のデコードを遅延させず、このスレッド内で済ませる
+    return pil_image
+
+
+def _load_prompt_info_file(file_path, mtime_ns):
+    """prompt_infoをパースする
+    
+    JSONファイルはそのままJSONとしてパースする。
+    YAMLは初回にパースして隣に`<ファイル名>.json`を書き出し、次回以降は
+    YAMLより新しいJSONがあればそちらを読む（YAMLを編集すれば自動的に無効化される）。
+    """
+    if file_path.suffix.lower() == ".json":
+        return json_loads(file_path.read_bytes())
+
+    sidecar_path = file_path.with_suffix(file_path.suffix + ".json")
+    try:
+        if sidecar_path.stat().st_mtime_ns >= mtime_ns:
+            return json_loads(sidecar_path.read_bytes())
+    except (OSError, ValueError):
+        pass
+
+    with file_path.open("r", encoding="utf-8") as f:
+        prompt_info = yaml.load(f, Loader=YamlLoader)
+
+    try:
+        sidecar_path.write_bytes(json_dumps_bytes(prompt_info))
+    except (OSError, TypeError):
+        pass  # キャッシュの書き出しに失敗しても読み込み自体は成功させる
+    return prompt_info
+
+
 def select_from_gallery(evt: gr.SelectData, displayed_paths):
     """ギャラリーから画像を選択したときの処理
     
@@ -28,57 +91,79 @@ def select_from_gallery(evt: gr.SelectData, displayed_paths):
     if evt.index < len(displayed_paths):
         selected_path = displayed_paths[evt.index]
         try:
-            preview = Image.open(selected_path) if Path(selected_path).exists() else None
-            return selected_path, preview
+            return selected_path, load_preview_cached(selected_path)
         except Exception:
             return selected_path, None
     return "", None
 
 
+def _to_filter_mode(mode):
+    """表示フィルターのラベルをget_history_gallery()のfilter_modeに変換"""
+    return "favorites" if mode in ("お気に入りのみ", "favorites") else "all"
+
+
 def update_gallery_display(filter_mode):
-    """ギャラリーの表示を更新"""
+    """ギャラリーの表示を更新
+    
+    設定が変更されていなければ、同じフィルターの前回の結果を返す。
+    
+    Args:
+        filter_mode: 表示フィルターのラベル（"全て"/"お気に入りのみ"）または"all"/"favorites"
+    """
+    filter_mode = _to_filter_mode(filter_mode)
+    version = get_settings_version()
+    cached = _GALLERY_CACHE.get(filter_mode)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
     gallery_items, displayed_paths = get_history_gallery(filter_mode)
+    _GALLERY_CACHE[filter_mode] = (version, (gallery_items, displayed_paths))
     return gallery_items, displayed_paths
 
 
+def get_history_choices_cached():
+    """履歴の選択肢を取得（設定が変更されていなければ前回の結果を返す）"""
+    version = get_settings_version()
+    if _HISTORY_CHOICES_CACHE["version"] == version:
+        return _HISTORY_CHOICES_CACHE["choices"]
+
+    choices = get_history_choices()
+    _HISTORY_CHOICES_CACHE["version"] = version
+    _HISTORY_CHOICES_CACHE["choices"] = choices
+    return choices
+
+
 def toggle_favorite(current_path, filter_mode):
     """お気に入りの追加/削除を切り替え"""
     if not current_path or current_path.strip() == "":
-        gallery_items, displayed_paths = get_history_gallery(filter_mode)
+        gallery_items, displayed_paths = update_gallery_display(filter_mode)
         return gallery_items, displayed_paths, "画像パスを選択してください"
     
     current_path = current_path.strip('"')
     
-    if is_favorite(current_path):
-        remove_from_favorites(current_path)
-        message = f"お気に入りから削除しました: {Path(current_path).name}"
-    else:
-        add_to_favorites(current_path)
+    added = toggle_favorite_path(current_path)
+    if added is None:
+        message = f"⚠️ パスが存在しません: {current_path}"
+    elif added:
         message = f"お気に入りに追加しました: {Path(current_path).name}"
+    else:
+        message = f"お気に入りから削除しました: {Path(current_path).name}"
     
     # ギャラリーを更新して返す
-    gallery_items, displayed_paths = get_history_gallery(filter_mode)
+    gallery_items, displayed_paths = update_gallery_display(filter_mode)
     return gallery_items, displayed_paths, message
 
 
 def show_image_row(current_count):
     """画像フォームの表示数を増やす"""
     new_count = min(current_count + 1, 10)  # 最大10個まで
-    updates = []
-    for i in range(10):
-        updates.append(gr.Row(visible=(i < new_count)))
-    updates.append(new_count)
-    return updates
+    return [*_ROW_UPDATES[new_count], new_count]
 
 
 def hide_image_row(current_count):
     """画像フォームの表示数を減らす"""
     new_count = max(current_count - 1, 1)  # 最低1個は表示
-    updates = []
-    for i in range(10):
-        updates.append(gr.Row(visible=(i < new_count)))
-    updates.append(new_count)
-    return updates
+    return [*_ROW_UPDATES[new_count], new_count]
 
 
 def load_prompt_info(file):
@@ -88,14 +173,21 @@ prompt_info.yamlを読み込んでフォームに流し込む"""
         # ファイルがない場合は全て空で返す
         empty_paths = [""] * 10
         empty_previews = [None] * 10
-        empty_rows = [gr.Row(visible=(i < 1)) for i in range(10)]
+        empty_rows = _ROW_UPDATES[1]
         return "", *empty_paths, *empty_previews, *empty_rows, 1
 
+    # 新しく読み込むファイルに含まれるパスは改めてstatする
+    clear_path_status_cache()
+
     try:
         file_path = Path(file.name) if hasattr(file, 'name') else Path(file)
 
-        with file_path.open("r", encoding="utf-8") as f:
-            prompt_info = yaml.safe_load(f)
+        # 同じファイルが未変更なら前回のパース結果を再利用
+        cache_key = (str(file_path), file_path.stat().st_mtime_ns)
+        prompt_info = _YAML_CACHE.get(cache_key)
+        if prompt_info is None:
+            prompt_info = _load_prompt_info_file(file_path, cache_key[1])
+            _YAML_CACHE[cache_key] = prompt_info
 
         prompt_text = prompt_info.get("text", "")
         image_paths = prompt_info.get("image_paths", [])
@@ -103,23 +195,12 @@ prompt_info.yamlを読み込んでフォームに流し込む"""
         # 画像数を取得し、最大10個まで制限
         num_images = min(len(image_paths), 10)
         
-        # 10個のパスとプレビューを準備
-        paths = []
-        previews = []
-        
-        for i in range(10):
-            if i < len(image_paths):
-                path = image_paths[i]
-                paths.append(path)
-                # 画像プレビューを読み込み
-                preview = Image.open(path) if path and Path(path).exists() else None
-                previews.append(preview)
-            else:
-                paths.append("")
-                previews.append(None)
+        # 10個のパスとプレビューを準備（プレビューは並列に読み込む）
+        paths = list(image_paths[:10]) + [""] * (10 - num_images)
+        previews = load_previews(paths)
         
         # Rowの表示設定（画像数分表示する）
-        row_updates = [gr.Row(visible=(i < num_images)) for i in range(10)]
+        row_updates = _ROW_UPDATES[num_images]
         
         return prompt_text, *paths, *previews, *row_updates, num_images
 
@@ -127,7 +208,7 @@ prompt_info.yamlを読み込んでフォームに流し込む"""
         # エラー時は全て空で返す
         empty_paths = [""] * 10
         empty_previews = [None] * 10
-        empty_rows = [gr.Row(visible=(i < 1)) for i in range(10)]
+        empty_rows = _ROW_UPDATES[1]
         return "", *empty_paths, *empty_previews, *empty_rows, 1
 
 
@@ -148,41 +229,45 @@ def run_request(output_folder, api_key, model, prompt, *args):
     image_paths = args[:10]  # 最初の10個が画像パス
     filter_modes = args[10:20] if len(args) >= 20 else ["全て"] * 10  # 次の10個がフィルターモード
     
-    # 空のパスをフィルタリング
-    valid_image_paths = [p for p in image_paths if p and p.strip() != ""]
-    valid_image_paths = [p.strip('"') for p in valid_image_paths]
-
-    # エラー時のデフォルト返り値を作成する関数
-    def create_error_response(message):
-        history = get_history_choices()
-        dropdown_updates = [gr.Dropdown(choices=history)] * 10
+    # 実行時点の状態で存在確認するため、stat結果のキャッシュを破棄
+    clear_path_status_cache()
+
+    # 結果メッセージに履歴ドロップダウンとギャラリーの更新を添えた返り値を作成する関数
+    def create_response(message, result_images=None):
+        # 10個のドロップダウンには同じ更新オブジェクトを使い回す
+        dropdown_update = gr.Dropdown(choices=get_history_choices_cached())
         # 各フィルターモードに応じてギャラリーを更新
         gallery_updates = []
         state_updates = []
         for mode in filter_modes:
-            filter_mode = "favorites" if mode == "お気に入りのみ" else "all"
-            gallery_items, displayed_paths = get_history_gallery(filter_mode)
+            gallery_items, displayed_paths = update_gallery_display(mode)
             gallery_updates.append(gallery_items)
             state_updates.append(displayed_paths)
-        return message, None, *dropdown_updates, *gallery_updates, *state_updates
+        return message, result_images, *([dropdown_update] * 10), *gallery_updates, *state_updates
+
+    # 空のパスを除外しつつ、パスの存在確認を1回の走査で行う
+    valid_image_paths = []
+    for p in image_paths:
+        if not p:
+            continue
+        path = p.strip().strip('"')
+        if not path:
+            continue
+        if not get_path_status(path)[0]:
+            return create_response(f"エラー: 画像パスが存在しません: {path}")
+        valid_image_paths.append(path)
 
     if not valid_image_paths:
-        return create_error_response("エラー: 少なくとも1つの画像パスを指定してください")
-
-    # パスの存在確認
-    for path in valid_image_paths:
-        if not Path(path).exists():
-            return create_error_response(f"エラー: 画像パスが存在しません: {path}")
+        return create_response("エラー: 少なくとも1つの画像パスを指定してください")
 
     if not prompt or prompt.strip() == "":
-        return create_error_response("エラー: プロンプトを入力してください")
+        return create_response("エラー: プロンプトを入力してください")
 
     if not api_key or api_key.strip() == "":
-        return create_error_response("エラー: OpenRouter API Keyを入力してください")
+        return create_response("エラー: OpenRouter API Keyを入力してください")
     
     # 画像パスを履歴に追加
-    for path in valid_image_paths:
-        add_to_history(path)
+    add_many_to_history(valid_image_paths)
 
     try:
         # モデルに応じてリクエスト実行
@@ -194,18 +279,25 @@ def run_request(output_folder, api_key, model, prompt, *args):
                 prompt, valid_image_paths, api_key)
 
         if response.status_code != 200:
-            return create_error_response(f"エラー: {response.status_code}\n{response.text}")
+            return create_response(f"エラー: {response.status_code}\n{response.text}")
 
         prompt_info_data = {
             "text": prompt,
             "image_paths": valid_image_paths
         }
 
-        # 結果を保存
-        save_response_images(Path(output_folder), response, prompt_info_data)
+        # レスポンスを一度だけパースし、保存処理と結果表示の両方で使う
+        response_data = parse_response_json(response)
+
+        # 結果の保存はバックグラウンドで行い、UIには先に結果を返す
+        # 出力フォルダの作成だけは先に行い、不正なフォルダはエラーとして返す
+        prepare_output_folder(Path(output_folder))
+        save_future = _SAVE_POOL.submit(
+            save_response_images, Path(output_folder), response, prompt_info_data,
+            response_data=response_data)
+        save_future.add_done_callback(_report_save_result)
 
         # レスポンスから結果テキストを取得
-        response_data = response.json()
         result_text = response_data.get("choices", [])[0].get(
             "message", {}).get("content", "")
         images = response_data.get("choices", [])[0].get(
@@ -224,32 +316,17 @@ def run_request(output_folder, api_key, model, prompt, *args):
             result += f"生成された画像数: {len(images)}\n"
             result += f"保存先: {output_folder}"
 
-        # 画像をPIL形式に変換
-        pil_images = []
-        if images:
-            for image_info in images:
-                base64_url = image_info["image_url"]["url"]
-                base64_data = base64_url_to_base64_image(base64_url)
-                pil_image = get_image_from_base64(base64_data)
-                pil_images.append(pil_image)
-        
-        # 更新された履歴を取得して全ドロップダウンとギャラリーを更新
-        updated_history = get_history_choices()
-        dropdown_updates = [gr.Dropdown(choices=updated_history)] * 10
-        
-        # 各フィルターモードに応じてギャラリーを更新
-        gallery_updates = []
-        state_updates = []
-        for mode in filter_modes:
-            filter_mode = "favorites" if mode == "お気に入りのみ" else "all"
-            gallery_items, displayed_paths = get_history_gallery(filter_mode)
-            gallery_updates.append(gallery_items)
-            state_updates.append(displayed_paths)
+        # 画像をPIL形式に変換（複数枚の場合は並列にデコード）
+        if len(images) > 1:
+            pil_images = list(_DECODE_POOL.map(_decode_result_image, images))
+        else:
+            pil_images = [_decode_result_image(image_info) for image_info in images]
         
-        return result, pil_images if pil_images else None, *dropdown_updates, *gallery_updates, *state_updates
+        # 更新された履歴で全ドロップダウンとギャラリーを更新
+        return create_response(result, pil_images if pil_images else None)
 
     except Exception as e:
-        return create_error_response(f"エラーが発生しました: {str(e)}")
+        return create_response(f"エラーが発生しました: {str(e)}")
 
 
 def create_ui():
@@ -290,7 +367,7 @@ def create_ui():
         with gr.Row():
             prompt_info_file = gr.File(
                 label="prompt_info.yamlをアップロード",
-                file_types=[".yaml", ".yml"],
+                file_types=[".yaml", ".yml", ".json"],
                 type="filepath",
                 height=150
             )
@@ -314,7 +391,7 @@ def create_ui():
         image_rows = []
         
         # 履歴を取得
-        history_choices = get_history_choices()
+        history_choices = get_history_choices_cached()
         
         # 履歴ギャラリーのリストを保持
         history_galleries = []
@@ -358,7 +435,7 @@ def create_ui():
                         favorite_messages.append(favorite_msg)
                         
                         # ギャラリーの表示パスリストを保持するState
-                        gallery_items, displayed_paths = get_history_gallery("all")
+                        gallery_items, displayed_paths = update_gallery_display("all")
                         gallery_path_state = gr.State(value=displayed_paths)
                         gallery_path_states.append(gallery_path_state)
                         
@@ -396,15 +473,13 @@ def create_ui():
                     image_previews.append(preview)
 
             # パス入力時のチェックとプレビュー更新
+            # 連続して発火した場合は最後の値だけを処理する
             image_path.change(
-                fn=check_image_path,
-                inputs=[image_path],
-                outputs=[warning]
-            )
-            image_path.change(
-                fn=load_image_preview,
+                fn=validate_and_preview,
                 inputs=[image_path],
-                outputs=[preview]
+                outputs=[warning, preview],
+                trigger_mode="always_last",
+                show_progress="hidden"
             )
             
             # 画像アップロード時の処理
@@ -416,14 +491,14 @@ def create_ui():
             
             # フィルター切り替え時にギャラリーを更新
             filter_radio.change(
-                fn=lambda mode: update_gallery_display("favorites" if mode == "お気に入りのみ" else "all"),
+                fn=update_gallery_display,
                 inputs=[filter_radio],
                 outputs=[history_gallery, gallery_path_state]
             )
             
             # お気に入りボタンのクリック処理
             favorite_btn.click(
-                fn=lambda path, mode: toggle_favorite(path, "favorites" if mode == "お気に入りのみ" else "all"),
+                fn=toggle_favorite,
                 inputs=[image_path, filter_radio],
                 outputs=[history_gallery, gallery_path_state, favorite_msg]
             )
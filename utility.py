@@ -4,75 +4,304 @@
 """
 
 import os
-import json
+import atexit
 import tempfile
+import functools
+import hashlib
+import secrets
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from PIL import Image
+from PIL import Image, UnidentifiedImageError
+from core import json_dumps_bytes, json_loads
+
+# プレビュー等で最初に判別を試す画像形式（よく使う形式に絞って他形式のプラグイン走査を省く）
+# これ以外の形式(BMP/TIFFなど)はopen_image()で全形式から判別し直す
+IMAGE_FORMATS = ("JPEG", "PNG", "WEBP", "GIF")
+
+# プラグインの登録を初回のImage.open()時ではなくインポート時に済ませておく
+Image.init()
+
+@functools.cache
+def _get_pool():
+    """サムネイル/プレビューのデコード用スレッドプールを取得（GALLERY_PARALLELISMは初回作成時のみ参照）"""
+    default_workers = min(16, (os.cpu_count() or 4) * 2)
+    try:
+        max_workers = max(1, int(os.getenv("GALLERY_PARALLELISM", default_workers)))
+    except ValueError:
+        max_workers = default_workers
+    return ThreadPoolExecutor(max_workers=max_workers)
+
+
+@functools.lru_cache(maxsize=8)
+def _ensure_dir(folder):
+    """フォルダを作成してPathを返す（同じフォルダのmkdirはプロセス内で1回だけ行う）"""
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    return folder
 
 
 def get_settings_path():
     """設定ファイルのパスを取得"""
-    settings_folder = os.getenv("SETTING_FOLDER_PATH", ".")
-    settings_folder = Path(settings_folder)
-    settings_folder.mkdir(parents=True, exist_ok=True)
-    return settings_folder / "settings.json"
+    return _ensure_dir(os.getenv("SETTING_FOLDER_PATH", ".")) / "settings.json"
+
+
+# settings.jsonの読み込み結果のキャッシュ（パス・更新時刻・サイズのいずれかが変わったら読み直す）
+# key: (パス, mtime_ns, サイズ)、version: 内容が変わるたびに増える番号、
+# dirty: ファイルへ未保存の変更があるか
+_SETTINGS_CACHE = {"key": None, "data": None, "favorites_set": frozenset(),
+                   "version": 0, "dirty": False}
+
+# 設定の読み込み→変更→保存をスレッド間で排他するロック
+_SETTINGS_LOCK = threading.RLock()
+
+# 存在しない履歴の削除をプロセス起動後に一度だけ行うためのフラグ
+_HISTORY_VALIDATION_STARTED = False
+
+# 履歴やお気に入りの変更後、この秒数だけ変更がなければまとめてファイルへ書き込む
+SETTINGS_FLUSH_DELAY = 1.0
+
+# 未保存の設定を書き込むためのタイマー（予約がなければNone）
+_FLUSH_TIMER = None
+
+# 新規作成する設定ファイルの権限（通常のopen()と同じくumaskを反映する）
+# umaskは取得のために一時的に書き換える必要があるため、スレッドが動き出す前のインポート時に1回だけ読む
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+_NEW_FILE_MODE = 0o666 & ~_UMASK
+
+
+def _settings_cache_key(settings_path):
+    """設定ファイルのキャッシュキーを取得（ファイルがない場合は(パス, None, None)）"""
+    try:
+        stat = settings_path.stat()
+    except FileNotFoundError:
+        return str(settings_path), None, None
+    return str(settings_path), stat.st_mtime_ns, stat.st_size
+
+
+# 履歴の最大件数・ギャラリーの最大表示数の既定値（settingsで上書き可能）
+DEFAULT_MAX_HISTORY_COUNT = 300
+DEFAULT_MAX_GALLERY_DISPLAY = 50
+
+
+def _get_int_setting(settings, key, default):
+    """settingsの数値設定を整数で取得（手で編集された"300"なども受け付け、不正な値や負の値は既定値）"""
+    try:
+        value = int(settings.get(key, default))
+    except (TypeError, ValueError):
+        return default
+    return value if value >= 0 else default
+
+
+def _normalize_settings(settings):
+    """履歴とお気に入りのキーを必ず持たせる（以降は既定値なしで直接参照できる）"""
+    settings.setdefault("image_path_history", [])
+    settings.setdefault("favorite_image_paths", [])
+    return settings
+
+
+def _update_settings_cache(settings, key, changed=True):
+    """設定のキャッシュを更新（changed=Trueの場合のみversionを進める、_SETTINGS_LOCK取得済みで呼ぶ）"""
+    _SETTINGS_CACHE["key"] = key
+    _SETTINGS_CACHE["data"] = settings
+    _SETTINGS_CACHE["favorites_set"] = frozenset(settings["favorite_image_paths"])
+    if changed:
+        _SETTINGS_CACHE["version"] += 1
+    _SETTINGS_CACHE["dirty"] = False
 
 
 def load_settings():
-    """設定ファイルを読み込む"""
-    settings_path = get_settings_path()
-    if settings_path.exists():
-        try:
-            with settings_path.open("r", encoding="utf-8") as f:
-                return json.load(f)
-        except Exception:
-            return {"image_path_history": [], "favorite_image_paths": []}
-    return {"image_path_history": [], "favorite_image_paths": []}
+    """設定ファイルを読み込む（未変更ならキャッシュ、未保存の変更があればメモリ上の内容を返す）"""
+    global _HISTORY_VALIDATION_STARTED
+    with _SETTINGS_LOCK:
+        if not _HISTORY_VALIDATION_STARTED:
+            _HISTORY_VALIDATION_STARTED = True
+            threading.Thread(target=_validate_history, daemon=True).start()
+
+        if _SETTINGS_CACHE["dirty"]:
+            return _SETTINGS_CACHE["data"]
+
+        settings_path = get_settings_path()
+        key = _settings_cache_key(settings_path)
+        if _SETTINGS_CACHE["data"] is not None and _SETTINGS_CACHE["key"] == key:
+            return _SETTINGS_CACHE["data"]
+
+        # ファイルがない・壊れている場合も既定値をそのキーでキャッシュし、
+        # ファイルが作成・変更されるまで読み直さない
+        settings = {"image_path_history": [], "favorite_image_paths": []}
+        if key[1] is not None:
+            try:
+                settings = _normalize_settings(json_loads(settings_path.read_bytes()))
+            except Exception as e:
+                print(f"Failed to load settings: {e}")
+        _update_settings_cache(settings, key, changed=settings != _SETTINGS_CACHE["data"])
+        return settings
+
+
+def get_settings_version():
+    """設定の内容が変わるたびに増える番号を取得（表示内容のキャッシュキー用）"""
+    with _SETTINGS_LOCK:
+        load_settings()  # 必要ならキャッシュを更新
+        return _SETTINGS_CACHE["version"]
+
+
+def get_favorites_set():
+    """お気に入りの画像パスをsetで取得"""
+    with _SETTINGS_LOCK:
+        load_settings()  # 必要ならキャッシュを更新
+        return _SETTINGS_CACHE["favorites_set"]
+
+
+def _prune_settings(settings):
+    """保存前に履歴を最大件数に切り詰める（prune_missing_on_saveなら存在しないパスも除く）"""
+    _normalize_settings(settings)
+    history = settings["image_path_history"]
+    if settings.get("prune_missing_on_save", False):
+        history = _filter_existing_paths(history)
+    max_history = _get_int_setting(settings, "max_history_count", DEFAULT_MAX_HISTORY_COUNT)
+    settings["image_path_history"] = history[:max_history]
 
 
 def save_settings(settings):
-    """設定ファイルを保存"""
-    settings_path = get_settings_path()
+    """設定ファイルを保存（予約済みの遅延書き込みはこの保存に含まれるため取り消す）"""
+    global _FLUSH_TIMER
+    with _SETTINGS_LOCK:
+        if _FLUSH_TIMER is not None:
+            _FLUSH_TIMER.cancel()
+            _FLUSH_TIMER = None
+        settings_path = get_settings_path()
+        tmp_path = None
+        try:
+            _prune_settings(settings)
+            # 同じフォルダの一時ファイルに書いてディスクへ同期してから置き換える
+            # （settings.jsonは常に書き込みが完了した正しいJSONになる）
+            with tempfile.NamedTemporaryFile(
+                    dir=settings_path.parent, prefix=".settings.", suffix=".tmp",
+                    delete=False) as f:
+                tmp_path = f.name
+                f.write(json_dumps_bytes(settings))
+                f.flush()
+                os.fsync(f.fileno())
+            # NamedTemporaryFileは0600で作成されるため、既存ファイル（なければumask）の権限に合わせる
+            try:
+                mode = settings_path.stat().st_mode & 0o777
+            except FileNotFoundError:
+                mode = _NEW_FILE_MODE
+            os.chmod(tmp_path, mode)
+            os.replace(tmp_path, settings_path)
+            tmp_path = None
+            _update_settings_cache(settings, _settings_cache_key(settings_path))
+        except Exception as e:
+            print(f"Failed to save settings: {e}")
+        finally:
+            if tmp_path is not None:
+                try:
+                    os.unlink(tmp_path)
+                except OSError:
+                    pass
+
+
+def _save_settings_later(settings):
+    """設定をメモリ上で更新し、少し後にまとめて保存する（_SETTINGS_LOCK取得済みで呼ぶ）"""
+    global _FLUSH_TIMER
+    _SETTINGS_CACHE["data"] = settings
+    _SETTINGS_CACHE["favorites_set"] = frozenset(settings["favorite_image_paths"])
+    _SETTINGS_CACHE["version"] += 1
+    _SETTINGS_CACHE["dirty"] = True
+    if _FLUSH_TIMER is not None:
+        _FLUSH_TIMER.cancel()
+    _FLUSH_TIMER = threading.Timer(SETTINGS_FLUSH_DELAY, flush_settings)
+    _FLUSH_TIMER.daemon = True
+    _FLUSH_TIMER.start()
+
+
+def flush_settings():
+    """未保存の設定があればファイルへ書き込む（終了時にも自動で呼ばれる）"""
+    with _SETTINGS_LOCK:
+        if _SETTINGS_CACHE["dirty"]:
+            save_settings(_SETTINGS_CACHE["data"])
+
+
+atexit.register(flush_settings)
+
+
+def _filter_existing_paths(paths):
+    """存在するパスのみを返す（親フォルダごとにos.scandir()を1回だけ呼ぶ）"""
+    names_by_dir = {}
+    paths_by_dir = defaultdict(list)
+    for path in paths:
+        paths_by_dir[os.path.dirname(path)].append(path)
+    for dir_path in paths_by_dir:
+        try:
+            with os.scandir(dir_path or ".") as entries:
+                names_by_dir[dir_path] = {entry.name for entry in entries}
+        except OSError:
+            names_by_dir[dir_path] = set()
+    return [
+        p for p in paths
+        if os.path.basename(p) in names_by_dir[os.path.dirname(p)] or os.path.exists(p)
+    ]
+
+
+def _validate_history():
+    """存在しなくなった画像パスを履歴から削除して保存（バックグラウンドで実行）"""
     try:
-        with settings_path.open("w", encoding="utf-8") as f:
-            json.dump(settings, f, ensure_ascii=False, indent=2)
+        # 時間のかかる存在確認はロックの外で行い、UIの読み込みを待たせない
+        history = list(load_settings()["image_path_history"])
+        stale_paths = set(history) - set(_filter_existing_paths(history))
+        if not stale_paths:
+            return
+        # 確認中に追加されたパスを消さないよう、読み直して古いパスだけを除く
+        with _SETTINGS_LOCK:
+            settings = load_settings()
+            settings["image_path_history"] = [
+                p for p in settings["image_path_history"] if p not in stale_paths]
+            save_settings(settings)
     except Exception as e:
-        print(f"Failed to save settings: {e}")
+        print(f"Failed to validate history: {e}")
 
 
 def add_to_history(path):
     """画像パスを履歴に追加"""
-    if not path or path.strip() == "":
-        return
-    
-    path = path.strip('"')
-    if not Path(path).exists():
+    add_many_to_history([path])
+
+
+def add_many_to_history(paths):
+    """複数の画像パスをまとめて履歴に追加（後に指定したパスほど先頭に来る）"""
+    new_paths = {}  # 挿入順を保った重複なしの集合として使う
+    for path in reversed(paths):
+        if not path or path.strip() == "":
+            continue
+        path = path.strip('"')
+        if path in new_paths or not get_path_status(path)[0]:
+            continue
+        new_paths[path] = None
+
+    if not new_paths:
         return
     
-    settings = load_settings()
-    history = settings.get("image_path_history", [])
-    
-    # 既存の場合は削除
-    if path in history:
-        history.remove(path)
-    
-    # 先頭に追加
-    history.insert(0, path)
-    
-    # 最大件数をsettingsから取得（デフォルト300件）
-    max_history = settings.get("max_history_count", 300)
-    history = history[:max_history]
-    
-    settings["image_path_history"] = history
-    save_settings(settings)
+    with _SETTINGS_LOCK:
+        settings = load_settings()
+        history = settings["image_path_history"]
+        
+        # 既存の場合は削除し、先頭に追加（dictの挿入順を使って1回の走査で重複を除く）
+        history = list(dict.fromkeys([*new_paths, *history]))
+        
+        # 最大件数をsettingsから取得（デフォルト300件）
+        max_history = _get_int_setting(settings, "max_history_count", DEFAULT_MAX_HISTORY_COUNT)
+        history = history[:max_history]
+        
+        settings["image_path_history"] = history
+        _save_settings_later(settings)
 
 
 def get_history_choices():
-    """履歴からドロップダウンの選択肢を取得"""
+    """履歴からドロップダウンの選択肢を取得（存在確認は起動時のバックグラウンド検証で行う）"""
     settings = load_settings()
-    history = settings.get("image_path_history", [])
-    # 存在するパスのみを返す
-    return [p for p in history if Path(p).exists()]
+    return list(settings["image_path_history"])
 
 
 def add_to_favorites(path):
@@ -81,17 +310,18 @@ def add_to_favorites(path):
         return
     
     path = path.strip('"')
-    if not Path(path).exists():
+    if not get_path_status(path)[0]:
         return
     
-    settings = load_settings()
-    favorites = settings.get("favorite_image_paths", [])
-    
-    # 既にお気に入りに入っている場合は何もしない
-    if path not in favorites:
-        favorites.append(path)
-        settings["favorite_image_paths"] = favorites
-        save_settings(settings)
+    with _SETTINGS_LOCK:
+        settings = load_settings()
+        favorites = settings["favorite_image_paths"]
+        
+        # 既にお気に入りに入っている場合は何もしない
+        if path not in get_favorites_set():
+            favorites.append(path)
+            settings["favorite_image_paths"] = favorites
+            _save_settings_later(settings)
 
 
 def remove_from_favorites(path):
@@ -100,13 +330,43 @@ def remove_from_favorites(path):
         return
     
     path = path.strip('"')
-    settings = load_settings()
-    favorites = settings.get("favorite_image_paths", [])
+    with _SETTINGS_LOCK:
+        settings = load_settings()
+        favorites = settings["favorite_image_paths"]
+        
+        if path in get_favorites_set():
+            favorites.remove(path)
+            settings["favorite_image_paths"] = favorites
+            _save_settings_later(settings)
+
+
+def toggle_favorite_path(path):
+    """画像パスのお気に入り登録を切り替える（設定の読み書きは1回だけ）
     
-    if path in favorites:
-        favorites.remove(path)
+    Returns:
+        bool or None: 追加した場合True、削除した場合False、
+            パスが空または存在せず追加できなかった場合None
+    """
+    if not path or path.strip() == "":
+        return None
+    
+    path = path.strip('"')
+    with _SETTINGS_LOCK:
+        settings = load_settings()
+        favorites = settings["favorite_image_paths"]
+        
+        if path in get_favorites_set():
+            favorites.remove(path)
+            added = False
+        elif get_path_status(path)[0]:
+            favorites.append(path)
+            added = True
+        else:
+            return None
+        
         settings["favorite_image_paths"] = favorites
-        save_settings(settings)
+        _save_settings_later(settings)
+        return added
 
 
 def is_favorite(path):
@@ -115,17 +375,24 @@ def is_favorite(path):
         return False
     
     path = path.strip('"')
-    settings = load_settings()
-    favorites = settings.get("favorite_image_paths", [])
-    return path in favorites
+    return path in get_favorites_set()
 
 
 def get_favorites_choices():
     """お気に入りからドロップダウンの選択肢を取得"""
     settings = load_settings()
-    favorites = settings.get("favorite_image_paths", [])
-    # 存在するパスのみを返す
-    return [p for p in favorites if Path(p).exists()]
+    favorites = settings["favorite_image_paths"]
+    # 存在するパスのみを返す（親フォルダ単位でまとめて確認）
+    return _filter_existing_paths(favorites)
+
+
+def _get_thumbnail_size(settings):
+    """settingsのgallery_thumbnail_sizeを取得（正の整数2つでなければ既定値）"""
+    size = settings.get("gallery_thumbnail_size", GALLERY_THUMBNAIL_SIZE)
+    if isinstance(size, (list, tuple)) and len(size) == 2 and all(
+            isinstance(v, int) and not isinstance(v, bool) and v > 0 for v in size):
+        return tuple(size)
+    return GALLERY_THUMBNAIL_SIZE
 
 
 def get_history_gallery(filter_mode="all"):
@@ -140,77 +407,287 @@ def get_history_gallery(filter_mode="all"):
             - displayed_paths: 実際に表示されている画像のパスリスト
     """
     settings = load_settings()
-    max_gallery_display = settings.get("max_gallery_display", 50)  # デフォルト50件
+    max_gallery_display = _get_int_setting(
+        settings, "max_gallery_display", DEFAULT_MAX_GALLERY_DISPLAY)
+    thumbnail_size = _get_thumbnail_size(settings)
     
     if filter_mode == "favorites":
         history_paths = get_favorites_choices()
     else:
         history_paths = get_history_choices()
     
+    favorites_set = get_favorites_set()
+    
+    def decode_thumbnail(path):
+        """(PIL Image, caption)のタプルを返す（表示できない場合はNone）"""
+        try:
+            # 存在しない場合はget_gallery_thumbnail()内のstatで例外になる
+            img = get_gallery_thumbnail(path, thumbnail_size)
+        except Exception:
+            return None
+        # お気に入りの場合は★マークを付ける
+        star = "★ " if path in favorites_set else ""
+        return img, star + os.path.basename(path)
+    
+    target_paths = history_paths[:max_gallery_display]
     gallery_items = []
     displayed_paths = []  # 実際に表示されているパスのリスト
-    favorites_set = set(settings.get("favorite_image_paths", []))
+    for path, item in zip(target_paths, _get_pool().map(decode_thumbnail, target_paths)):
+        if item is not None:
+            gallery_items.append(item)
+            displayed_paths.append(path)  # 表示されたパスを記録
+    return gallery_items, displayed_paths
+
+
+@functools.lru_cache(maxsize=1024)
+def get_path_status(path):
+    """パスの存在有無と更新時刻(ns)を返す（clear_path_status_cache()までキャッシュ）
     
-    for path in history_paths[:max_gallery_display]:
+    Returns:
+        tuple: (exists, mtime_ns) - 存在しない場合は(False, None)
+    """
+    try:
+        return True, os.stat(path).st_mtime_ns
+    except OSError:
+        return False, None
+
+
+def clear_path_status_cache():
+    """get_path_status()のキャッシュを破棄（ユーザー操作の起点で呼ぶ）"""
+    get_path_status.cache_clear()
+
+
+# プレビュー表示用の最大サイズ（表示枠は高さ100px）
+PREVIEW_SIZE = (256, 256)
+
+# 履歴ギャラリーのサムネイルの最大サイズ（settingsのgallery_thumbnail_sizeで変更可能）
+GALLERY_THUMBNAIL_SIZE = (256, 256)
+
+
+def open_image(path):
+    """画像を開く（IMAGE_FORMATSで判別できなければ全形式から判別する）"""
+    try:
+        return Image.open(path, formats=IMAGE_FORMATS)
+    except UnidentifiedImageError:
+        return Image.open(path)
+
+
+def open_thumbnail(path, size):
+    """画像を縮小して読み込む（JPEGはdraft()で縮小デコードし、フルサイズのデコードを避ける）"""
+    img = open_image(path)
+    img.draft(img.mode, size)
+    img.load()  # ファイルハンドルを解放するため読み込みを完了させる
+    img.thumbnail(size, Image.Resampling.BILINEAR)
+    return img
+
+
+# サムネイルのキャッシュフォルダの合計サイズの上限（超えたら古いものから削除）
+MAX_THUMBNAIL_CACHE_BYTES = 256 * 1024 * 1024
+
+# プロセスで最初の1枚と、以降この枚数を書き込むごとにキャッシュフォルダのサイズを確認する
+_THUMBNAIL_EVICT_INTERVAL = 100
+
+# 書き込み途中で異常終了したプロセスの一時ファイルとみなして削除するまでの秒数
+_STALE_THUMBNAIL_TMP_SECONDS = 60 * 60
+
+# このプロセスで書き込んだサムネイルの枚数
+_THUMBNAIL_WRITE_COUNT = 0
+_THUMBNAIL_WRITE_LOCK = threading.Lock()
+
+
+def get_thumbnail_cache_dir():
+    """ギャラリー用サムネイルのキャッシュフォルダを取得（設定フォルダのthumb_cache）"""
+    return get_settings_path().parent / "thumb_cache"
+
+
+def _evict_thumbnail_cache(cache_dir):
+    """キャッシュが上限を超えていれば使われていない順に削除（古い一時ファイルも削除）"""
+    stale_before_ns = time.time_ns() - _STALE_THUMBNAIL_TMP_SECONDS * 1_000_000_000
+    entries = []
+    try:
+        with os.scandir(cache_dir) as it:
+            for e in it:
+                stat = e.stat()
+                if e.name.endswith(".webp"):
+                    entries.append((stat.st_mtime_ns, stat.st_size, e.path))
+                elif e.name.endswith(".tmp") and stat.st_mtime_ns < stale_before_ns:
+                    try:
+                        os.unlink(e.path)
+                    except OSError:
+                        pass
+    except OSError:
+        return
+    total = sum(size for _, size, _ in entries)
+    if total <= MAX_THUMBNAIL_CACHE_BYTES:
+        return
+    for _, size, entry_path in sorted(entries):
         try:
-            if Path(path).exists():
-                # (PIL Image, caption)のタプルで返す
-                img = Image.open(path)
-                # お気に入りの場合は★マークを付ける
-                star = "★ " if path in favorites_set else ""
-                caption = star + Path(path).name
-                gallery_items.append((img, caption))
-                displayed_paths.append(path)  # 表示されたパスを記録
-        except Exception:
+            os.unlink(entry_path)
+        except OSError:
             continue
-    return gallery_items, displayed_paths
+        total -= size
+        if total <= MAX_THUMBNAIL_CACHE_BYTES:
+            break
 
 
-def load_image_preview(path):
-    """画像パスからプレビューを読み込む"""
-    if not path or path.strip() == "":
-        return None
+def get_gallery_thumbnail(path, size=GALLERY_THUMBNAIL_SIZE):
+    """ギャラリー用のサムネイルを取得（縮小済み画像をWebPでディスクにキャッシュ）"""
+    global _THUMBNAIL_WRITE_COUNT
+    stat = os.stat(path)
+    key = hashlib.blake2b(
+        f"{os.path.abspath(path)}|{stat.st_mtime_ns}|{stat.st_size}|{size[0]}x{size[1]}"
+        .encode("utf-8"), digest_size=16).hexdigest()
+    cache_dir = get_thumbnail_cache_dir()
+    cache_path = cache_dir / f"{key}.webp"
 
-    path = path.strip('"')
+    try:
+        img = Image.open(cache_path, formats=("WEBP",))
+        img.load()
+    except (OSError, ValueError):
+        pass
+    else:
+        try:
+            os.utime(cache_path)  # 最近使ったものとして削除の対象から外す
+        except OSError:
+            pass  # 読み取り専用のキャッシュでも読み込んだサムネイルはそのまま使う
+        return img
 
+    img = open_thumbnail(path, size)
+    if img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGBA" if img.mode in ("LA", "P", "PA") else "RGB")
+    # 書き込み途中のファイルを読まないよう、一時ファイルに書いてから置き換える
+    tmp_path = cache_path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
     try:
-        if Path(path).exists():
-            return Image.open(path)
+        _ensure_dir(os.fspath(cache_dir))
+        img.save(tmp_path, "WEBP", quality=80)
+        os.replace(tmp_path, cache_path)
+        tmp_path = None
+    except (OSError, ValueError) as e:
+        print(f"Failed to save thumbnail cache: {e}")
+        return img
+    finally:
+        if tmp_path is not None:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+
+    with _THUMBNAIL_WRITE_LOCK:
+        _THUMBNAIL_WRITE_COUNT += 1
+        should_evict = (_THUMBNAIL_WRITE_COUNT - 1) % _THUMBNAIL_EVICT_INTERVAL == 0
+    if should_evict:
+        _evict_thumbnail_cache(cache_dir)
+    return img
+
+
+@functools.lru_cache(maxsize=64)
+def _load_preview_cached(path, mtime_ns):
+    """プレビュー画像を読み込む（mtime_ns はキャッシュキーとしてのみ使用）"""
+    return open_thumbnail(path, PREVIEW_SIZE)
+
+
+def load_preview_cached(path):
+    """パスと更新時刻をキーにキャッシュしたプレビュー画像を返す（存在しない場合はNone）"""
+    exists, mtime_ns = get_path_status(path)
+    if not exists:
         return None
+    return _load_preview_cached(path, mtime_ns)
+
+
+# これより大きい画像ファイルはprompt_info読み込み時のプレビューを省略する
+MAX_PREVIEW_FILE_SIZE = 50 * 1024 * 1024
+
+
+def _load_preview_with_message(path):
+    """プレビューを読み込み、サイズ上限で省略した場合は警告メッセージも返す
+    
+    Returns:
+        tuple: (preview, message) - プレビュー画像（なければNone）と警告メッセージ（なければ空文字）
+    """
+    if not path:
+        return None, ""
+    try:
+        # サイズと更新時刻を1回のstatで取得する
+        stat = os.stat(path)
+    except OSError:
+        return None, ""  # 存在しない場合の警告はcheck_image_path()で出す
+    if stat.st_size >= MAX_PREVIEW_FILE_SIZE:
+        size_mb = stat.st_size // (1024 * 1024)
+        return None, f"⚠️ ファイルが大きいためプレビューを省略しました ({size_mb}MB): {path}"
+    try:
+        return _load_preview_cached(path, stat.st_mtime_ns), ""
     except Exception:
-        return None
+        return None, ""
+
+
+def load_previews(paths):
+    """複数の画像パスのプレビューを並列に読み込む
+    
+    Returns:
+        list: pathsと同じ順序のプレビュー画像（読み込めないものはNone）
+    """
+    return [preview for preview, _ in _get_pool().map(_load_preview_with_message, paths)]
+
+
+def load_image_preview(path):
+    """画像パスからプレビューを読み込む（サイズ上限を超える場合はNone）"""
+    return _load_preview_with_message((path or "").strip().strip('"'))[0]
 
 
 def check_image_path(path):
     """画像パスが存在するかチェック"""
-    if not path or path.strip() or path.strip('"') == "":
+    path = (path or "").strip().strip('"')
+    if not path:
         return ""
-    if not Path(path).exists():
+    if not get_path_status(path)[0]:
         return f"⚠️ パスが存在しません: {path}"
     return ""
 
 
+def validate_and_preview(path):
+    """画像パスの存在チェックとプレビュー読み込みを1回のイベントでまとめて行う
+    
+    Returns:
+        tuple: (warning, preview) - 警告メッセージとプレビュー画像（なければNone）
+    """
+    # パスが編集されたので、古いstat結果を使わないようにする
+    clear_path_status_cache()
+    warning = check_image_path(path)
+    preview, message = _load_preview_with_message((path or "").strip().strip('"'))
+    return warning or message, preview
+
+
 def handle_image_upload(image):
     """アップロードされた画像を一時ファイルとして保存し、パスを返す"""
     if image is None:
         return "", None
     
     try:
-        # 画像がファイルパスの場合
+        # 画像がファイルパスの場合は保存し直さず、縮小済みのプレビューを返す
+        # （続くパスの変更イベントでも同じキャッシュが使われる）
         if isinstance(image, str):
-            return image, Image.open(image)
+            return image, load_image_preview(image)
         
         # PIL Imageの場合、一時ファイルに保存
         # 環境変数から一時ディレクトリのベースを取得
         temp_base = os.getenv("TEMP_IMAGE_DIR", tempfile.gettempdir())
-        temp_dir = Path(temp_base) / "gradio_images"
-        temp_dir.mkdir(parents=True, exist_ok=True)
+        temp_dir = _ensure_dir(os.path.join(temp_base, "gradio_images"))
         
-        import time
-        timestamp = int(time.time() * 1000)
-        temp_path = temp_dir / f"uploaded_{timestamp}.png"
+        # 同時にアップロードされても衝突しないよう、ナノ秒の時刻に乱数を付ける
+        file_stem = f"uploaded_{time.time_ns()}_{secrets.token_hex(4)}"
         
-        image.save(temp_path)
+        # 元がJPEGの画像や大きな写真はJPEGで、それ以外は低圧縮のPNGで保存する
+        # （PNGのデフォルト圧縮は重く、一時ファイルには不要）
+        is_jpeg = image.format == "JPEG"
+        is_large_photo = image.mode == "RGB" and image.width * image.height > 1_000_000
+        if image.mode in ("RGB", "L") and (is_jpeg or is_large_photo):
+            temp_path = temp_dir / f"{file_stem}.jpg"
+            image.save(temp_path, "JPEG", quality=95 if is_jpeg else 92, optimize=False)
+        else:
+            temp_path = temp_dir / f"{file_stem}.png"
+            image.save(temp_path, "PNG", compress_level=1)
+        # 新しいファイルを作成したので、古いstat結果を使わないようにする
+        clear_path_status_cache()
         return str(temp_path), image
     except Exception:
         return "", None